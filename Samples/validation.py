@@ -2,8 +2,65 @@
 validation.py: Validates project
 """
 import logging
+import tempfile
 
-from macos_pkg_builder import Packages
+from pathlib import Path
+
+from macos_pkg_builder import Packages, FlatPackage, DistributionPackage
+
+
+def validate_work_directory_reuse() -> bool:
+    """
+    Build repeatedly within a single working directory, including after cleanup().
+    Staging from a previous build must not leak into the next.
+    """
+    with tempfile.TemporaryDirectory() as work_directory:
+        first = FlatPackage(
+            pkg_output="Sample-Reuse.pkg",
+            pkg_bundle_id="com.myapp.reuse",
+            pkg_preinstall_script="Samples/MyApp/MyPreinstall.sh",
+            pkg_file_structure={
+                "Samples/MyApp/MyLaunchDaemon.plist": "/Library/LaunchDaemons/com.myapp.plist",
+            },
+            pkg_work_directory=work_directory,
+        )
+        second = FlatPackage(
+            pkg_output="Sample-Reuse.pkg",
+            pkg_bundle_id="com.myapp.reuse",
+            pkg_preinstall_script="Samples/MyApp/MyPreinstall.sh",
+            pkg_file_structure={
+                "Samples/MyApp/MyApp.app": "/Applications/MyApp.app",
+            },
+            pkg_work_directory=work_directory,
+        )
+
+        if first.build() is False or second.build() is False:
+            return False
+
+        # Payload of the first build must not be merged into the second.
+        if Path(work_directory, "build", "Library").exists():
+            return False
+
+        second.cleanup()
+        if second.build() is False:
+            return False
+
+        distribution = DistributionPackage(
+            pkg_output="Sample-Reuse.pkg",
+            pkg_inputs=["Sample-Reuse.pkg"],
+            pkg_bundle_id="com.myapp.reuse",
+            pkg_title="Reuse",
+            pkg_work_directory=Path(work_directory, "distribution"),
+        )
+
+        if distribution.build() is False:
+            return False
+
+        distribution.cleanup()
+        if distribution.build() is False:
+            return False
+
+    return True
 
 
 def main():
@@ -49,10 +106,13 @@ def main():
         ),
     ]
 
-    for test_suite in test_suites:
-        if test_suite.build() is False:
-            logging.info("Package build failed.")
-            exit(1)
+    if Packages.batch_build(test_suites) is False:
+        logging.info("Package build failed.")
+        exit(1)
+
+    if validate_work_directory_reuse() is False:
+        logging.info("Package build within a reused working directory failed.")
+        exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,8 +6,13 @@ macOS Package Builder
 Designed to simplify package creation through native tooling, ex. pkgbuild, productbuild, etc.
 """
 
+import os
+import hashlib
 import logging
+import tempfile
+import concurrent.futures
 
+from typing import Union
 from pathlib import Path
 
 from .flat_pkg import FlatPackage
@@ -16,6 +21,9 @@ from .distribution_pkg import DistributionPackage
 
 class Packages:
 
+    # Shared across instances, allowing concurrent builds without oversubscribing the host.
+    _exec_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count())
+
     def __init__(self,
                  pkg_output:              str,
                  pkg_bundle_id:           str,
@@ -36,6 +44,7 @@ class Packages:
                  pkg_license:             str = None,
                  pkg_background:          str = None,
                  pkg_background_dark:     str = None,
+                 pkg_skip_unchanged:     bool = False,
                 ) -> None:
         """
         pkg_output:             Path to where the package will be saved.
@@ -86,6 +95,7 @@ class Packages:
 
         pkg_signing_identity:   Signing identity to use when signing the package.
                                 If missing, no signing will be performed.
+                                If 'pkg_as_distribution' is True, only the final product archive is signed.
                                 Default: None
                                 Optional.
 
@@ -118,6 +128,11 @@ class Packages:
                                 Default: None
                                 Optional. Requires 'pkg_as_distribution' to be True.
 
+        pkg_skip_unchanged:     Skip building if the configuration and sources are unchanged since the last build of 'pkg_output'.
+                                Sources are compared by path, size and modification time, stored next to the package as '<pkg_output>.fingerprint'.
+                                Default: False
+                                Optional.
+
         File Structure:
             {
                 # Source: Destination
@@ -146,6 +161,7 @@ class Packages:
         self._pkg_license            = pkg_license
         self._pkg_background         = pkg_background
         self._pkg_background_dark    = pkg_background_dark
+        self._pkg_skip_unchanged     = pkg_skip_unchanged
 
         _requires_distribution = [
             self._pkg_title,
@@ -160,12 +176,133 @@ class Packages:
             raise Exception("Distribution files require 'pkg_as_distribution' to be True.")
 
 
+    @staticmethod
+    def batch_build(packages: list, max_workers: int = None, return_results: bool = False) -> Union[bool, list]:
+        """
+        Build multiple packages concurrently, sharing a single temporary directory.
+
+        Each package must have a unique 'pkg_output', concurrent builds would otherwise race on the same file.
+        Raises ValueError if multiple packages resolve to the same 'pkg_output'.
+        Returns True only if all packages were built successfully.
+        If 'return_results' is True, returns the result of each build instead, in the order provided.
+
+        Builds run on a dedicated pool of 'max_workers' threads, defaulting to the CPU count.
+        The pool shared with build_async() isn't used, as calling batch_build() from one of its jobs could otherwise deadlock.
+        """
+
+        outputs = [os.path.realpath(os.fspath(package._pkg_output)) for package in packages]
+        if len(set(outputs)) != len(outputs):
+            raise ValueError("Packages must have unique 'pkg_output' paths to be built concurrently.")
+
+        with tempfile.TemporaryDirectory() as root:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+                jobs = [executor.submit(package._build, Path(root, f"pkg_{index}")) for index, package in enumerate(packages)]
+
+            # Executor waits for every build on exit, so the shared directory outlives them even if one raised.
+            results = [job.result() for job in jobs]
+
+        if return_results is True:
+            return results
+
+        return all(results)
+
+
+    def build_async(self) -> concurrent.futures.Future:
+        """
+        Build the application package in the background.
+
+        Returns a Future resolving to the result of build().
+        Jobs share a pool across all Packages instances, avoid waiting on this Future from within another build_async() job.
+        """
+        return Packages._exec_pool.submit(self._build)
+
+
     def build(self) -> bool:
         """
         Build the application package.
         """
+        # Run on the calling thread, avoiding a deadlock should build() be called from within the shared pool.
+        return self._build()
+
+
+    def _fingerprint(self) -> str:
+        """
+        Generate a fingerprint of the package configuration and sources.
+
+        Sources are fingerprinted by path, size and modification time, avoiding reading their contents.
+        """
+
+        fingerprint = hashlib.blake2b(digest_size=16)
+        fingerprint.update(repr(sorted(
+            (key, value) for key, value in vars(self).items() if key.startswith("_pkg_")
+        )).encode())
+
+        sources = [
+            *(self._pkg_file_structure or {}),
+            self._pkg_preinstall_script,
+            self._pkg_preflight_script,
+            self._pkg_postinstall_script,
+            self._pkg_postflight_script,
+            *(self._pkg_script_resources or []),
+            self._pkg_background,
+            self._pkg_background_dark,
+        ]
+
+        for source in sources:
+            if source is None:
+                continue
+
+            paths = [source]
+            if os.path.isdir(source):
+                paths = [os.path.join(root, name) for root, directories, files in os.walk(source) for name in directories + files]
+
+            for path in paths:
+                try:
+                    stat = os.lstat(path)
+                except FileNotFoundError:
+                    fingerprint.update(f"{path}:missing\n".encode())
+                    continue
+                fingerprint.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+
+        return fingerprint.hexdigest()
+
+
+    def _build(self, work_directory: Path = None) -> bool:
+        """
+        Build the application package, optionally within a provided working directory.
+        """
+
+        if self._pkg_skip_unchanged is False:
+            return self._build_package(work_directory)
+
+        fingerprint = self._fingerprint()
+        fingerprint_file = Path(os.fspath(self._pkg_output) + ".fingerprint")
+        if Path(self._pkg_output).exists() and fingerprint_file.exists():
+            if fingerprint_file.read_text() == fingerprint:
+                logging.info("Package unchanged, skipping build: %s", self._pkg_output)
+                return True
+
+        fingerprint_file.unlink(missing_ok=True)
+
+        if self._build_package(work_directory) is False:
+            return False
+
+        fingerprint_file.write_text(fingerprint)
+
+        return True
+
+
+    def _build_package(self, work_directory: Path = None) -> bool:
+        """
+        Build the flat package, then convert it to a distribution package if requested.
+        """
+
+        if work_directory is None and self._pkg_as_distribution is True:
+            # Share a single temporary directory between both stages, rather than one each.
+            with tempfile.TemporaryDirectory() as root:
+                return self._build_package(Path(root))
 
-        result = FlatPackage(
+        with FlatPackage(
             pkg_output=self._pkg_output,
             pkg_bundle_id=self._pkg_project_identifier,
             pkg_version=self._pkg_project_version,
@@ -177,8 +314,11 @@ class Packages:
             pkg_postinstall_script=self._pkg_postinstall_script,
             pkg_postflight_script=self._pkg_postflight_script,
             pkg_script_resources=self._pkg_script_resources,
-            pkg_signing_identity=self._pkg_signing_identity
-        ).build()
+            # Component packages are embedded in the product archive, which is signed as a whole.
+            pkg_signing_identity=self._pkg_signing_identity if self._pkg_as_distribution is False else None,
+            pkg_work_directory=Path(work_directory, "flat") if work_directory is not None else None
+        ) as pkg:
+            result = pkg.build()
 
         if result is False:
             return False
@@ -188,7 +328,7 @@ class Packages:
 
         logging.info("Converting to distribution package.")
 
-        result = DistributionPackage(
+        with DistributionPackage(
             pkg_output=self._pkg_output,
             pkg_inputs=[self._pkg_output],
             pkg_bundle_id=self._pkg_project_identifier,
@@ -199,8 +339,10 @@ class Packages:
             pkg_license=self._pkg_license,
             pkg_background=self._pkg_background,
             pkg_background_dark=self._pkg_background_dark,
-            pkg_signing_identity=self._pkg_signing_identity
-        ).build()
+            pkg_signing_identity=self._pkg_signing_identity,
+            pkg_work_directory=Path(work_directory, "distribution") if work_directory is not None else None
+        ) as pkg:
+            result = pkg.build()
 
         return result
 
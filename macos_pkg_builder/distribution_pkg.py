@@ -2,23 +2,28 @@
 distribution_pkg.py: Builds a distribution package.
 """
 
+import os
+import shutil
 import logging
-import markdown
-import tempfile
 import subprocess
+import functools
 
 from pathlib import Path
-from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
 
-from .utilities import copy
+from .utilities import copy, subprocess_wrapper
 from .utilities.signing import SignPackage
-from .utilities.subprocess_wrapper import SubprocessWrapper, SubprocessErrorLogging
+from .utilities.workspace import PackageWorkspace
+from .utilities.subprocess_wrapper import SubprocessErrorLogging
 
 
 PRODUCTBUILD: str = "/usr/bin/productbuild"
 
+HTML_HEADER: bytes = b"<!DOCTYPE html>\n<html>\n<head>\n<style>\nbody { font-family: -apple-system; }\n</style>\n</head>\n<body>\n"
+HTML_FOOTER: bytes = b"</body>\n</html>\n"
 
-class DistributionPackage:
+
+class DistributionPackage(PackageWorkspace):
 
     def __init__(self,
                  pkg_inputs:              list[str],
@@ -32,6 +37,7 @@ class DistributionPackage:
                  pkg_license:             str = None,
                  pkg_background:          str = None,
                  pkg_background_dark:     str = None,
+                 pkg_work_directory:      str = None,
                  ) -> None:
 
         self._pkg_inputs = pkg_inputs
@@ -46,91 +52,142 @@ class DistributionPackage:
         self._pkg_background = pkg_background
         self._pkg_background_dark = pkg_background_dark
 
-        self._markdown_file_mapping = {
-            self._pkg_welcome: "WELCOME.html",
-            self._pkg_readme:  "README.html",
-            self._pkg_license: "LICENSE.html"
-        }
+        self._pkg_has_resources = any([
+            self._pkg_title,
+            self._pkg_welcome,
+            self._pkg_readme,
+            self._pkg_license,
+            self._pkg_background,
+            self._pkg_background_dark,
+        ])
 
         # If a dark background is not provided, use the light background.
         if self._pkg_background is not None and self._pkg_background_dark is None:
             self._pkg_background_dark = self._pkg_background
 
-        self._background_mapping = {
-            "light": {
-                "property": self._pkg_background,
-                "file": f"BACKGROUND{Path(self._pkg_background).suffix if self._pkg_background is not None else ''}",
-                "label": "background",
-            },
-            "dark": {
-                "property": self._pkg_background_dark,
-                "file": f"BACKGROUND-DARK{Path(self._pkg_background_dark).suffix if self._pkg_background_dark is not None else ''}",
-                "label": "background-darkAqua",
-            }
+        self._init_workspace(pkg_work_directory)
+        self._pkg_product_output      = os.fspath(self._pkg_output) + ".product"
+        # Inputs commonly share a directory, only pass each once.
+        self._pkg_input_directories   = list(dict.fromkeys(str(Path(pkg).parent) for pkg in self._pkg_inputs))
+
+
+    @functools.cached_property
+    def _markdown_file_mapping(self) -> dict:
+        """
+        Provided markdown content, keyed by resource file name.
+        """
+        pages = {
+            "WELCOME.html": self._pkg_welcome,
+            "README.html":  self._pkg_readme,
+            "LICENSE.html": self._pkg_license,
         }
-        self._pkg_temp_directory      = tempfile.TemporaryDirectory()
-        self._pkg_temp_directory      = Path(self._pkg_temp_directory.name)
+        return {file: content for file, content in pages.items() if content is not None}
+
+
+    @functools.cached_property
+    def _background_mapping(self) -> dict:
+        """
+        Provided background images, keyed by appearance.
+
+        If light and dark are the same image, dark references the light copy with no 'property' to copy.
+        """
+        backgrounds = {
+            "light": (self._pkg_background,      "BACKGROUND",      "background"),
+            "dark":  (self._pkg_background_dark, "BACKGROUND-DARK", "background-darkAqua"),
+        }
+        mapping = {
+            appearance: {"property": path, "file": f"{name}{Path(path).suffix}", "label": label}
+            for appearance, (path, name, label) in backgrounds.items() if path is not None
+        }
+
+        if "light" in mapping and "dark" in mapping:
+            light = mapping["light"]["property"]
+            dark  = mapping["dark"]["property"]
+
+            # Including differing paths to the same file (ex. symlinks).
+            if light == dark or (os.path.exists(light) and os.path.exists(dark) and os.path.samefile(light, dark)):
+                mapping["dark"]["property"] = None
+                mapping["dark"]["file"] = mapping["light"]["file"]
+
+        return mapping
+
+
+    def _define_workspace(self) -> None:
+        """
+        Derive paths within the working directory.
+        """
         self._pkg_resources_directory = Path(self._pkg_temp_directory, "resources")
+        self._pkg_distribution_file   = Path(self._pkg_temp_directory, "distribution.xml")
+
+
+    def _clear_workspace(self) -> None:
+        """
+        Remove staging left by a previous build.
+        """
+        shutil.rmtree(self._pkg_resources_directory, ignore_errors=True)
+        self._pkg_distribution_file.unlink(missing_ok=True)
 
 
     def _prepare_markdown_resources(self) -> None:
         """
         Convert content from markdown to HTML, then save it to the resources directory.
         """
-        for file in self._markdown_file_mapping:
-            if file is None:
-                continue
+        if not self._markdown_file_mapping:
+            return
+
+        # Share a single converter, avoiding re-registering extensions for each file.
+        converter = None
 
-            Path(self._pkg_resources_directory).mkdir(parents=True, exist_ok=True)
+        for file, content in self._markdown_file_mapping.items():
+            html = ""
+            if content.strip():
+                if converter is None:
+                    # Imported lazily, as it's costly and only required for distribution pages.
+                    import markdown
+                    converter = markdown.Markdown()
+                html = converter.reset().convert(content)
 
-            with open(self._pkg_resources_directory / self._markdown_file_mapping[file], "w") as f:
-                f.write("<!DOCTYPE html>\n<html>\n<head>\n<style>\nbody { font-family: -apple-system; }\n</style>\n</head>\n<body>\n")
-                f.write(markdown.markdown(file))
-                f.write("</body>\n</html>\n")
+            Path(self._pkg_resources_directory, file).write_bytes(HTML_HEADER + html.encode("utf-8") + HTML_FOOTER)
 
 
     def _prepare_background_resources(self) -> None:
         """
         Prepare background resources for the distribution package.
         """
-        # Check if light and dark are the same, if so, only copy one.
-        if self._background_mapping["light"]["property"] == self._background_mapping["dark"]["property"]:
-            self._background_mapping["dark"]["property"] = None
-            self._background_mapping["dark"]["file"] = self._background_mapping["light"]["file"]
-
         for background in self._background_mapping:
+            # Skip backgrounds sharing another's file.
             if self._background_mapping[background]["property"] is None:
                 continue
             if not Path(self._background_mapping[background]["property"]).exists():
                 raise FileNotFoundError(f"Background image not found: {self._background_mapping[background]['property']}")
 
-            Path(self._pkg_resources_directory).mkdir(parents=True, exist_ok=True)
-            SubprocessWrapper(copy.generate_copy_arguments(self._background_mapping[background]["property"], self._pkg_resources_directory.joinpath(self._background_mapping[background]["file"])), raise_on_error=True).run()
+            copy.copy_path(self._background_mapping[background]["property"], self._pkg_resources_directory.joinpath(self._background_mapping[background]["file"]))
 
 
-    def _prepare_distribution_file(self, input_file: tempfile.NamedTemporaryFile) -> None:
+    def _prepare_distribution_file(self, distribution_file: Path) -> None:
         """
         Sync the distribution file with the provided content.
+
+        Elements are spliced in before the closing tag, avoiding a full parse and serialize of the document.
         """
-        tree = ET.parse(input_file.name)
-        root = tree.getroot()
+        elements = []
 
         if self._pkg_title is not None:
-            element = ET.Element("title")
-            element.text = self._pkg_title
-            root.append(element)
+            elements.append(f"<title>{escape(self._pkg_title)}</title>")
 
         for background in self._background_mapping:
-            element = ET.Element(self._background_mapping[background]["label"], file=self._background_mapping[background]["file"], alignment="bottomleft", scaling="tofit")
-            root.append(element)
+            elements.append(f"<{self._background_mapping[background]['label']} file={quoteattr(self._background_mapping[background]['file'])} alignment=\"bottomleft\" scaling=\"tofit\" />")
 
         for file in self._markdown_file_mapping:
-            if file is not None:
-                element_name = self._markdown_file_mapping[file].split(".")[0].lower()
-                element = ET.Element(element_name, file=self._markdown_file_mapping[file], mimetype="text/html")
-                root.append(element)
+            elements.append(f"<{file.split('.')[0].lower()} file={quoteattr(file)} mimetype=\"text/html\" />")
 
-        tree.write(input_file.name)
+        data = distribution_file.read_bytes()
+
+        index = data.rfind(b"</installer-gui-script>")
+        if index == -1:
+            raise ValueError(f"Invalid distribution file: {distribution_file}")
+
+        distribution_file.write_bytes(data[:index] + "".join(elements).encode("utf-8") + data[index:])
 
 
     def _generate_pkg_synthesize_arguments(self, output: str) -> list:
@@ -143,7 +200,7 @@ class DistributionPackage:
             "--synthesize",
         ]
         for pkg in self._pkg_inputs:
-            args.extend(["--package", pkg])
+            args.extend(["--package", os.fspath(pkg)])
 
         if self._pkg_bundle_id is not None:
             args.extend(["--identifier", self._pkg_bundle_id])
@@ -155,54 +212,114 @@ class DistributionPackage:
         return args
 
 
-    def _generate_pkg_build_arguments(self, distribution_file: tempfile.NamedTemporaryFile) -> list:
+    def _generate_pkg_product_arguments(self) -> list:
+        """
+        Generate productbuild arguments for building directly from the input packages.
+        """
+
+        args = [PRODUCTBUILD]
+        for pkg in self._pkg_inputs:
+            args.extend(["--package", os.fspath(pkg)])
+
+        if self._pkg_bundle_id is not None:
+            args.extend(["--identifier", self._pkg_bundle_id])
+        if self._pkg_version is not None:
+            args.extend(["--version", self._pkg_version])
+
+        if self._pkg_signing_identity is not None:
+            args.extend(["--sign", self._pkg_signing_identity])
+
+        args.extend([self._pkg_product_output])
+
+        return args
+
+
+    def _generate_pkg_build_arguments(self, distribution_file: Path) -> list:
         """
         Generate productbuild arguments according to the provided configuration.
         """
 
         args = [
             PRODUCTBUILD,
-            "--distribution", distribution_file.name,
-            "--resources", self._pkg_resources_directory
+            "--distribution", os.fspath(distribution_file),
+            "--resources", os.fspath(self._pkg_resources_directory)
         ]
 
-        for pkg in self._pkg_inputs:
-            args.extend(["--package-path", Path(pkg).parent])
+        for directory in self._pkg_input_directories:
+            args.extend(["--package-path", directory])
+
+        if self._pkg_signing_identity is not None:
+            args.extend(["--sign", self._pkg_signing_identity])
 
-        args.extend([self._pkg_output + ".product"])
+        args.extend([self._pkg_product_output])
 
         return args
 
 
-    def build(self) -> bool:
+    def _build_from_distribution(self) -> bool:
         """
-        Build the distribution package.
+        Synthesize a distribution file, customize it with the provided resources, then build the product archive from it.
+
+        Synthesizing is required as productbuild inspects the input packages, ex. for 'hostArchitectures' and 'installKBytes'.
         """
 
-        distribution_file = tempfile.NamedTemporaryFile(delete=False)
+        # Kept within the working directory, removed alongside it on cleanup.
+        distribution_file = self._pkg_distribution_file
 
-        result = subprocess.run(self._generate_pkg_synthesize_arguments(distribution_file.name), capture_output=True)
+        # Shared by markdown and background resources, and required by productbuild's '--resources'.
+        self._pkg_resources_directory.mkdir(parents=True, exist_ok=True)
+
+        process = subprocess_wrapper.spawn(self._generate_pkg_synthesize_arguments(os.fspath(distribution_file)), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        # Resources don't depend on the distribution file, prepare them while productbuild synthesizes.
+        try:
+            self._prepare_markdown_resources()
+            self._prepare_background_resources()
+        finally:
+            _, stderr = process.communicate()
+
+        result = subprocess.CompletedProcess(process.args, process.returncode, None, stderr)
         if result.returncode != 0:
             SubprocessErrorLogging(result).log()
             return False
 
-        self._prepare_markdown_resources()
-        self._prepare_background_resources()
         self._prepare_distribution_file(distribution_file)
 
-        result = subprocess.run(self._generate_pkg_build_arguments(distribution_file), capture_output=True)
+        result = subprocess_wrapper.run(self._generate_pkg_build_arguments(distribution_file), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0:
             SubprocessErrorLogging(result).log()
             return False
 
+        return True
+
+
+    def build(self) -> bool:
+        """
+        Build the distribution package.
+        """
+
+        output_path = Path(self._pkg_output)
+
         if self._pkg_signing_identity is not None:
-            SignPackage(self._pkg_output + ".product", self._pkg_signing_identity).sign()
+            # Validate upfront, productbuild will sign the package during creation.
+            if SignPackage(self._pkg_output, self._pkg_signing_identity).is_identity_valid() is False:
+                return False
+
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._ensure_workspace()
+
+        if self._pkg_has_resources is False:
+            # Nothing to customize, productbuild can generate the distribution file itself in a single invocation.
+            result = subprocess_wrapper.run(self._generate_pkg_product_arguments(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                SubprocessErrorLogging(result).log()
+                return False
+        elif self._build_from_distribution() is False:
+            return False
 
-        # Rename output file.
-        if Path(self._pkg_output).exists():
-            Path(self._pkg_output).unlink()
-        Path(self._pkg_output + ".product").rename(self._pkg_output)
+        # Atomically move over any existing package.
+        os.replace(self._pkg_product_output, self._pkg_output)
 
-        logging.info(f"Distribution package built: {self._pkg_output}")
+        logging.info("Distribution package built: %s", self._pkg_output)
 
         return True
\ No newline at end of file
@@ -2,25 +2,52 @@
 flat_pkg.py: Builds a flat package.
 """
 
+import os
+import stat
+import shutil
 import logging
-import plistlib
-import tempfile
 import subprocess
+import concurrent.futures
 
 from pathlib import Path
+from xml.sax.saxutils import escape
 
-from .utilities import copy
+from .utilities import copy, subprocess_wrapper
 from .utilities.xattr import ExtendedAttributes
 from .utilities.signing import SignPackage
+from .utilities.workspace import PackageWorkspace
 from .utilities.subprocess_wrapper import SubprocessWrapper, SubprocessErrorLogging
 
 
 PKGBUILD: str = "/usr/bin/pkgbuild"
-CHMOD:    str = "/bin/chmod"
 RM:       str = "/bin/rm"
 
+# Copies mostly wait on disk I/O, allow more workers than cores.
+COPY_WORKERS: int = min(32, (os.cpu_count() or 1) * 4)
+
+# Equivalent to plistlib's output, only relocation and bundle path vary between packages.
+COMPONENT_TEMPLATE: str = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<array>
+	<dict>
+		<key>BundleHasStrictIdentifier</key>
+		<true/>
+		<key>BundleIsRelocatable</key>
+		<{relocatable}/>
+		<key>BundleIsVersionChecked</key>
+		<true/>
+		<key>BundleOverwriteAction</key>
+		<string>upgrade</string>
+		<key>RootRelativeBundlePath</key>
+		<string>{bundle}</string>
+	</dict>
+</array>
+</plist>
+"""
+
 
-class FlatPackage:
+class FlatPackage(PackageWorkspace):
 
     def __init__(self,
                  pkg_output:              str,
@@ -35,6 +62,7 @@ class FlatPackage:
                  pkg_postflight_script:   str = None,
                  pkg_script_resources:   list = None,
                  pkg_signing_identity:    str = None,
+                 pkg_work_directory:      str = None,
                 ) -> None:
 
         self._pkg_output = pkg_output
@@ -50,21 +78,99 @@ class FlatPackage:
         self._pkg_script_resources = pkg_script_resources
         self._pkg_signing_identity = pkg_signing_identity
 
-        self._pkg_temp_directory      = tempfile.TemporaryDirectory()
-        self._pkg_temp_directory      = Path(self._pkg_temp_directory.name)
+        self._init_workspace(pkg_work_directory)
+        # Written next to the final output, allowing an atomic rename rather than a copy once built.
+        self._pkg_temp_output         = Path(os.fspath(self._pkg_output) + ".tmp")
+        self._pkg_bundle_destination  = None
+        self._pkg_build_arguments     = None
+        # Known upfront, avoids probing the filesystem for the scripts directory.
+        self._pkg_has_scripts         = any([
+            self._pkg_preinstall_script,
+            self._pkg_preflight_script,
+            self._pkg_postinstall_script,
+            self._pkg_postflight_script,
+            self._pkg_script_resources,
+        ])
+
+
+
+    def cleanup(self) -> None:
+        """
+        Remove the working directory, unless provided by the caller.
+        """
+        super().cleanup()
+        # Arguments reference the working directory, regenerate on next build.
+        self._pkg_build_arguments = None
+
+
+    def _define_workspace(self) -> None:
+        """
+        Derive paths within the working directory.
+        """
         self._pkg_build_directory     = Path(self._pkg_temp_directory, "build")
         self._pkg_scripts_directory   = Path(self._pkg_temp_directory, "scripts")
         self._pkg_output_directory    = Path(self._pkg_temp_directory, "output")
         self._pkg_resources_directory = Path(self._pkg_temp_directory, "resources")
-        self._pkg_temp_output         = Path(self._pkg_temp_directory, Path(self._pkg_output).name)
+        self._pkg_component_plist     = Path(self._pkg_temp_directory, "component.plist")
+
+
+    def _clear_workspace(self) -> None:
+        """
+        Remove staging left by a previous build.
+
+        Scripts would otherwise be reported as already existing, and payloads merged with the previous build.
+        """
+        shutil.rmtree(self._pkg_build_directory, ignore_errors=True)
+        shutil.rmtree(self._pkg_scripts_directory, ignore_errors=True)
+
+
+    def _make_executable(self, path: str) -> None:
+        """
+        Add execute permissions to path, equivalent to 'chmod +x'.
+        """
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+    def _stage_script(self, source: str, destination: Path) -> None:
+        """
+        Copy script or script resource into the scripts directory, and mark it executable.
+        """
+        # Copy rather than link: chmod and xattr stripping would modify hard linked sources,
+        # while pkgbuild archives symlinks as-is, pointing to paths only valid on this machine.
+        # On Copy on Write volumes the copy is a clone regardless, moving no data.
+        copy.copy_path(source, destination)
+
+        if os.path.isdir(source):
+            for root, directories, files in os.walk(destination):
+                self._make_executable(root)
+                for name in directories + files:
+                    path = os.path.join(root, name)
+                    if not os.path.islink(path):
+                        self._make_executable(path)
+        else:
+            self._make_executable(destination)
+
+        ExtendedAttributes(destination).strip_xattr("com.apple.quarantine")
+
 
+    def _stage_file(self, source: str, destination: str) -> None:
+        """
+        Copy file or bundle into the build directory.
+        """
+        copy.copy_path(source, destination)
+        ExtendedAttributes(destination).strip_xattr("com.apple.quarantine")
 
 
-    def _prepare_scripts(self) -> None:
+    def _prepare_scripts(self, executor: concurrent.futures.Executor) -> list:
         """
         Adjusts naming and permissions of scripts to match pkgbuild requirements.
+
+        Copies are dispatched to the provided executor, returns their futures.
         """
 
+        jobs = []
+        staged = set()
+
         _working_directory = self._pkg_scripts_directory
         _file_map = {
             "preinstall":  self._pkg_preinstall_script,
@@ -73,66 +179,70 @@ class FlatPackage:
             "postflight":  self._pkg_postflight_script,
         }
 
+        if self._pkg_has_scripts:
+            _working_directory.mkdir(parents=True, exist_ok=True)
+
         for script, path in _file_map.items():
             if path is None:
                 continue
 
-            if not Path(path).exists():
-                raise FileNotFoundError(f"{script.capitalize()} script not found: {path}")
+            source = Path(path)
+            destination = _working_directory.joinpath(script)
 
-            if not _working_directory.exists():
-                _working_directory.mkdir(parents=True, exist_ok=True)
+            if not source.exists():
+                raise FileNotFoundError(f"{script.capitalize()} script not found: {path}")
 
-            if Path(path).is_dir():
+            if source.is_dir():
                 raise IsADirectoryError(f"{script.capitalize()} script is a directory: {path}")
 
-            if Path(_working_directory.joinpath(script)).exists():
+            if destination.exists():
                 raise FileExistsError(f"Script already exists: {script}")
 
-            SubprocessWrapper(copy.generate_copy_arguments(path, _working_directory.joinpath(script)), raise_on_error=True).run()
-            SubprocessWrapper([CHMOD, "+x", _working_directory.joinpath(script)], raise_on_error=True).run()
-            ExtendedAttributes(_working_directory.joinpath(script)).strip_xattr("com.apple.quarantine")
+            staged.add(script)
+            jobs.append(executor.submit(self._stage_script, path, destination))
 
         if self._pkg_script_resources is not None:
             for resources in self._pkg_script_resources:
-                if not Path(resources).exists():
-                    raise FileNotFoundError(f"Script resource not found: {resources}")
+                source = Path(resources)
+                destination = _working_directory.joinpath(source.name)
 
-                if not _working_directory.exists():
-                    _working_directory.mkdir(parents=True, exist_ok=True)
+                if not source.exists():
+                    raise FileNotFoundError(f"Script resource not found: {resources}")
 
-                if Path(_working_directory.joinpath(Path(resources).name)).exists():
+                # Copies run concurrently, so track staged names rather than relying on the filesystem.
+                if source.name in staged or destination.exists():
                     raise FileExistsError(f"Script resource already exists: {resources}")
 
-                SubprocessWrapper(copy.generate_copy_arguments(resources, _working_directory), raise_on_error=True).run()
+                staged.add(source.name)
+                jobs.append(executor.submit(self._stage_script, resources, destination))
 
-                if Path(resources).is_dir():
-                    SubprocessWrapper([CHMOD, "-R", "+x", _working_directory.joinpath(Path(resources).name)], raise_on_error=True).run()
-                    ExtendedAttributes(_working_directory.joinpath(Path(resources).name)).strip_xattr("com.apple.quarantine")
-                else:
-                    SubprocessWrapper([CHMOD, "+x", _working_directory.joinpath(Path(resources).name)], raise_on_error=True).run()
-                    ExtendedAttributes(_working_directory.joinpath(Path(resources).name)).strip_xattr("com.apple.quarantine")
+        return jobs
 
 
-    def _prepare_file_structure(self) -> None:
+    def _prepare_file_structure(self, executor: concurrent.futures.Executor) -> list:
         """
         Adjusts file structure to match pkgbuild requirements.
+
+        Parent directories are created before dispatching copies to the provided executor, returns their futures.
         """
 
         if self._pkg_file_structure is None:
-            return
+            return []
 
-        for source, destination in self._pkg_file_structure.items():
-            if not Path(source).exists():
-                raise FileNotFoundError(f"Source file does not exist: {source}")
+        # Validate all sources before touching the build directory.
+        missing = [source for source in self._pkg_file_structure if not os.path.exists(source)]
+        if missing:
+            raise FileNotFoundError(f"Source file does not exist: {', '.join(missing)}")
 
-            internal_destination = Path(f"{self._pkg_build_directory}{destination}")
+        # Destinations are absolute, so plain concatenation avoids a Path allocation per entry.
+        build_directory = str(self._pkg_build_directory)
+        jobs = [(source, build_directory + destination) for source, destination in self._pkg_file_structure.items()]
 
-            if not internal_destination.parent.exists():
-                internal_destination.parent.mkdir(parents=True, exist_ok=True)
+        # Entries commonly share parents (ex. /Library/LaunchDaemons), only create each once.
+        for parent in {os.path.dirname(internal_destination) for _, internal_destination in jobs}:
+            os.makedirs(parent, exist_ok=True)
 
-            SubprocessWrapper(copy.generate_copy_arguments(source, internal_destination), raise_on_error=True).run()
-            ExtendedAttributes(internal_destination).strip_xattr("com.apple.quarantine")
+        return [executor.submit(self._stage_file, source, internal_destination) for source, internal_destination in jobs]
 
 
     def _generate_component_file(self) -> Path:
@@ -141,26 +251,26 @@ class FlatPackage:
         """
 
         # Find anything with an Info.plist embedded, needs to be a valid bundle for pkgbuild.
-        bundle = None
-        for source, destination in self._pkg_file_structure.items():
-            if Path(source, "Contents", "Info.plist").exists():
-                bundle = destination
-                break
-
+        # Cached, as the file structure does not change between builds.
+        if self._pkg_bundle_destination is None:
+            self._pkg_bundle_destination = next(
+                (destination for source, destination in self._pkg_file_structure.items() if os.path.exists(os.path.join(source, "Contents", "Info.plist"))),
+                None
+            )
+
+        bundle = self._pkg_bundle_destination
         if bundle is None:
             raise ValueError("No valid bundle found in the provided file structure.")
 
-        contents = [{
-            "BundleHasStrictIdentifier": True,
-            "BundleIsRelocatable":       self._pkg_allow_relocation,
-            "BundleIsVersionChecked":    True,
-            "BundleOverwriteAction":     "upgrade",
-            "RootRelativeBundlePath":    bundle,
-        }]
-        file = tempfile.NamedTemporaryFile(delete=False)
-        plistlib.dump(contents, Path(file.name).open("wb"))
+        self._pkg_component_plist.write_text(
+            COMPONENT_TEMPLATE.format(
+                relocatable="true" if self._pkg_allow_relocation else "false",
+                bundle=escape(bundle),
+            ),
+            encoding="utf-8",
+        )
 
-        return Path(file.name)
+        return self._pkg_component_plist
 
 
     def _generate_pkg_arguments(self) -> list:
@@ -175,7 +285,7 @@ class FlatPackage:
             "--root",       self._pkg_build_directory
         ]
 
-        if self._pkg_scripts_directory.exists():
+        if self._pkg_has_scripts:
             args.extend(["--scripts", self._pkg_scripts_directory])
 
         if self._pkg_file_structure is not None:
@@ -185,17 +295,24 @@ class FlatPackage:
         else:
             args.extend(["--nopayload"])
 
+        if self._pkg_signing_identity is not None:
+            args.extend(["--sign", self._pkg_signing_identity])
 
         args.extend([self._pkg_temp_output])
 
-        return args
+        # Convert paths once up front, rather than having subprocess re-encode them on invocation.
+        return [str(arg) if isinstance(arg, Path) else arg for arg in args]
 
 
     def _build_pkg(self) -> bool:
         """
         Build a flat package. Private method.
         """
-        result = subprocess.run(self._generate_pkg_arguments(), capture_output=True)
+        # Only depends on the configuration and working directory, generate once per instance.
+        if self._pkg_build_arguments is None:
+            self._pkg_build_arguments = self._generate_pkg_arguments()
+
+        result = subprocess_wrapper.run(self._pkg_build_arguments, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0:
             SubprocessErrorLogging(result).log()
             return False
@@ -207,28 +324,41 @@ class FlatPackage:
         """
         Build a flat package. Public method.
         """
-        if all([self._pkg_file_structure is None, self._pkg_preinstall_script is None, self._pkg_postinstall_script is None]):
+        if self._pkg_file_structure is None and self._pkg_preinstall_script is None and self._pkg_postinstall_script is None:
             raise ValueError("Cannot build a package! No file structure or scripts provided.")
 
-        if Path(self._pkg_output).exists():
+        output_path = Path(self._pkg_output)
+
+        if self._pkg_signing_identity is not None:
+            # Validate upfront, pkgbuild will sign the package during creation.
+            if SignPackage(self._pkg_temp_output, self._pkg_signing_identity).is_identity_valid() is False:
+                return False
+
+        if output_path.exists():
             # Use over Path.unlink() to avoid weird permission issues.
             SubprocessWrapper([RM, self._pkg_output], raise_on_error=True).run()
 
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self._ensure_workspace()
         self._pkg_build_directory.mkdir(parents=True, exist_ok=True)
 
-        self._prepare_scripts()
-        self._prepare_file_structure()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            jobs = self._prepare_scripts(executor) + self._prepare_file_structure(executor)
+
+        # Executor has drained, surface every failure rather than only the first encountered.
+        failures = [job.exception() for job in jobs if job.exception() is not None]
+        for failure in failures[1:]:
+            logging.error("Failed to stage package contents: %s", failure)
+        if failures:
+            raise failures[0]
 
         if self._build_pkg() is False:
             logging.info("Package build failed.")
+            self._pkg_temp_output.unlink(missing_ok=True)
             return False
 
-        if self._pkg_signing_identity is not None:
-            if SignPackage(self._pkg_temp_output, self._pkg_signing_identity).sign() is False:
-                return False
-
-        SubprocessWrapper(copy.generate_copy_arguments(self._pkg_temp_output, self._pkg_output), raise_on_error=True).run()
+        os.replace(self._pkg_temp_output, self._pkg_output)
 
-        logging.info(f"Flat Package built: {self._pkg_output}")
+        logging.info("Flat Package built: %s", self._pkg_output)
 
         return True
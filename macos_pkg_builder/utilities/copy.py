@@ -1,140 +1,100 @@
 """
-copy.py: Library for generating performant 'cp' commands on macOS.
+copy.py: Library for performant file copying on macOS.
 """
 
+import os
 import ctypes
+import shutil
 
 from pathlib import Path
 
 
-def can_copy_on_write(source: str, destination: str) -> bool:
-    """
-    Check if Copy on Write is supported between source and destination
-    """
-    source_obj = PathAttributes(source)
-    return source_obj.mount_point() == PathAttributes(str(Path(destination).parent)).mount_point() and source_obj.supports_clonefile()
-
-
-def generate_copy_arguments(source: str, destination: str) -> list:
-    """
-    Generate performant '/bin/cp' arguments for macOS
-    """
-    _command = ["/bin/cp", source, destination]
-    if not Path(source).exists():
-        raise FileNotFoundError(f"Source file not found: {source}")
-    if not Path(destination).parent.exists():
-        raise FileNotFoundError(f"Destination directory not found: {destination}")
-
-    # Check if Copy on Write is supported.
-    if can_copy_on_write(source, destination):
-        _command.insert(1, "-c")
-
-    if Path(source).is_dir():
-        _command.insert(1, "-R")
-
-    return _command
-
-
-class attrreference_t(ctypes.Structure):
-    _fields_ = [
-        ("attr_dataoffset", ctypes.c_int32),
-        ("attr_length",     ctypes.c_uint32)
+# Reference:
+# https://github.com/apple-oss-distributions/copyfile/blob/copyfile-213/copyfile.h
+COPYFILE_ALL:       int = 0x0000000F  # COPYFILE_ACL | COPYFILE_STAT | COPYFILE_XATTR | COPYFILE_DATA
+COPYFILE_RECURSIVE: int = 0x00008000  # Copy directory hierarchies
+COPYFILE_CLONE:     int = 0x01000000  # Clone if supported, otherwise fall back to a regular copy
+
+try:
+    _libc = ctypes.CDLL("/usr/lib/libc.dylib", use_errno=True)
+except OSError:
+    _libc = None
+
+_copyfile = getattr(_libc, "copyfile", None)
+if _copyfile is not None:
+    _copyfile.argtypes = [
+        ctypes.c_char_p,  # Source
+        ctypes.c_char_p,  # Destination
+        ctypes.c_void_p,  # State
+        ctypes.c_uint32,  # Flags
     ]
-
-class attrlist_t(ctypes.Structure):
-    _fields_ = [
-        ("bitmapcount", ctypes.c_ushort),
-        ("reserved",    ctypes.c_uint16),
-        ("commonattr",  ctypes.c_uint),
-        ("volattr",     ctypes.c_uint),
-        ("dirattr",     ctypes.c_uint),
-        ("fileattr",    ctypes.c_uint),
-        ("forkattr",    ctypes.c_uint)
-    ]
-
-class volattrbuf(ctypes.Structure):
-    _fields_ = [
-        ("length",          ctypes.c_uint32),
-        ("mountPoint",      attrreference_t),
-        ("volCapabilities", ctypes.c_uint64),
-        ("mountPointSpace", ctypes.c_char * 1024),
+    _copyfile.restype = ctypes.c_int
+
+# Reference:
+# https://github.com/apple-oss-distributions/xnu/blob/xnu-10063.121.3/bsd/sys/clonefile.h
+_clonefile = getattr(_libc, "clonefile", None)
+if _clonefile is not None:
+    _clonefile.argtypes = [
+        ctypes.c_char_p,  # Source
+        ctypes.c_char_p,  # Destination
+        ctypes.c_uint32,  # Flags
     ]
+    _clonefile.restype = ctypes.c_int
 
 
-class PathAttributes:
-
-    def __init__(self, path: str) -> None:
-        self._path = path
-        if not isinstance(self._path, str):
-            try:
-                self._path = str(self._path)
-            except:
-                raise ValueError(f"Invalid path: {path}")
-
-        _libc = ctypes.CDLL("/usr/lib/libc.dylib")
-
-        # Reference:
-        # https://developer.apple.com/library/archive/documentation/System/Conceptual/ManPages_iPhoneOS/man2/getattrlist.2.html
-        try:
-            self._getattrlist = _libc.getattrlist
-        except AttributeError:
-            return
-
-        self._getattrlist.argtypes = [
-            ctypes.c_char_p,             # Path
-            ctypes.POINTER(attrlist_t),  # Attribute list
-            ctypes.c_void_p,             # Attribute buffer
-            ctypes.c_ulong,              # Attribute buffer size
-            ctypes.c_ulong               # Options
-        ]
-        self._getattrlist.restype = ctypes.c_int
-
-        # Reference:
-        # https://github.com/apple-oss-distributions/xnu/blob/xnu-10063.121.3/bsd/sys/attr.h
-        ATTR_BIT_MAP_COUNT     = 0x00000005
-        ATTR_VOL_CAPABILITIES  = 0x00020000
-        ATTR_VOL_MOUNTPOINT    = 0x00001000
-
-        attrList = attrlist_t()
-        attrList.bitmapcount = ATTR_BIT_MAP_COUNT
-        attrList.volattr     = ATTR_VOL_MOUNTPOINT | ATTR_VOL_CAPABILITIES
+def clone_file(source: str, destination: str) -> str:
+    """
+    Copy a single file through copyfile(3), cloning on Copy on Write volumes (ex. APFS)
 
-        volAttrBuf = volattrbuf()
+    Falls back to shutil.copy2 if copyfile(3) is unavailable or fails.
+    Signature matches shutil.copytree's 'copy_function'.
+    """
+    if _copyfile is not None:
+        if _copyfile(os.fsencode(source), os.fsencode(destination), None, COPYFILE_ALL | COPYFILE_CLONE) == 0:
+            return destination
 
-        if self._getattrlist(self._path.encode(), ctypes.byref(attrList), ctypes.byref(volAttrBuf), ctypes.sizeof(volAttrBuf), 0) != 0:
-            return
+    return shutil.copy2(source, destination)
 
-        self._volAttrBuf = volAttrBuf
 
+def clone_tree(source: str, destination: str) -> bool:
+    """
+    Clone a directory hierarchy with a single clonefile(2) call, metadata only on Copy on Write volumes (ex. APFS)
 
-    def supports_clonefile(self) -> bool:
-        """
-        Verify if path provided supports Apple's clonefile function.
+    Returns False if cloning is unsupported (ex. ENOTSUP, EXDEV) or destination exists, allowing callers to fall back to a regular copy.
+    """
+    if _clonefile is None or os.path.lexists(destination):
+        return False
 
-        Equivalent to checking for Copy on Write support.
-        """
-        VOL_CAP_INT_CLONE = 0x00010000
+    return _clonefile(os.fsencode(source), os.fsencode(destination), 0) == 0
 
-        if not hasattr(self, "_volAttrBuf"):
-            return False
 
-        if self._volAttrBuf.volCapabilities & VOL_CAP_INT_CLONE:
-            return True
+def copy_tree(source: str, destination: str) -> bool:
+    """
+    Copy a directory hierarchy with a single recursive copyfile(3) call, cloning files where supported
 
+    Returns False if copyfile(3) is unavailable, fails or destination exists, allowing callers to fall back to shutil.copytree.
+    """
+    if _copyfile is None or os.path.lexists(destination):
         return False
 
+    return _copyfile(os.fsencode(source), os.fsencode(destination), None, COPYFILE_ALL | COPYFILE_RECURSIVE | COPYFILE_CLONE) == 0
 
-    def mount_point(self) -> str:
-        """
-        Return mount point of path.
-        """
 
-        if not hasattr(self, "_volAttrBuf"):
-            return ""
+def copy_path(source: str, destination: str) -> None:
+    """
+    Copy file or directory in-process, preserving symlinks and metadata
+    """
+    if not Path(source).exists():
+        raise FileNotFoundError(f"Source file not found: {source}")
+    if not Path(destination).parent.exists():
+        raise FileNotFoundError(f"Destination directory not found: {destination}")
 
-        mount_point_ptr = ctypes.cast(
-            ctypes.addressof(self._volAttrBuf.mountPoint) + self._volAttrBuf.mountPoint.attr_dataoffset,
-            ctypes.POINTER(ctypes.c_char * self._volAttrBuf.mountPoint.attr_length)
-        )
+    if Path(source).is_dir():
+        # Cheapest first: clone the whole hierarchy, then copy it in-kernel, then copy it file by file.
+        if clone_tree(source, destination) or copy_tree(source, destination):
+            return
+        shutil.copytree(source, destination, symlinks=True, dirs_exist_ok=True, copy_function=clone_file)
+        return
 
-        return mount_point_ptr.contents.value.decode()
\ No newline at end of file
+    # Match 'cp' by copying the target of symlinked sources, copyfile(3) would otherwise copy the link itself.
+    clone_file(os.path.realpath(source), destination)
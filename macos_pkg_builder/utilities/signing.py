@@ -1,51 +1,81 @@
 """
 signing.py: Package Signing Utilities
 
-Note that while pkgbuild and productbuild support passing the signing identity as an argument,
-separating this step allows for easier debugging and testing.
+Note that package creation passes the signing identity to pkgbuild and productbuild directly,
+avoiding an additional productsign pass and rewrite of the package.
 
-If a noticeable performance hit is observed, consider merging this step with the package building
+This class remains for validating signing identities, as well as signing existing packages.
 """
 
+import os
+import re
 import logging
 import subprocess
 
-from pathlib import Path
-
 from . import subprocess_wrapper
 
 
 PRODUCTSIGN: str = "/usr/bin/productsign"
 SECURITY:    str = "/usr/bin/security"
 
+# ex. '  1) 0123456789ABCDEF0123456789ABCDEF01234567 "Developer ID Installer: Name (TEAMID)"'
+IDENTITY_PATTERN: re.Pattern = re.compile(rb'^\s*\d+\)\s+([0-9A-F]{40})\s+"(.*)"', re.MULTILINE)
+
 
 class SignPackage:
 
+    # Identities from 'security find-identity', mapping SHA-1 hash to name.
+    # Shared across instances as keychain state rarely changes mid-process.
+    _identity_cache: dict = None
+
     def __init__(self, pkg: str, identity: str) -> None:
         self.pkg = pkg
         self.identity = identity
 
+        self._identity_valid = None
 
-    def _is_identity_valid(self) -> bool:
+
+    @classmethod
+    def invalidate_identity_cache(cls) -> None:
+        """
+        Clear cached signing identities, forcing the next validation to query the keychain.
+        """
+        cls._identity_cache = None
+
+
+    def is_identity_valid(self) -> bool:
         """
         Check if the provided signing identity is valid.
+
+        Once valid, the result is kept for the lifetime of the instance.
         """
 
-        args = [
-            SECURITY,
-            "find-identity",
-            "-v",
-        ]
+        if self._identity_valid is True:
+            return True
 
-        result = subprocess.run(args, capture_output=True)
-        if result.returncode != 0:
-            subprocess_wrapper.SubprocessErrorLogging(result).log()
-            return False
+        if SignPackage._identity_cache is None:
+            args = [
+                SECURITY,
+                "find-identity",
+                "-v",
+            ]
 
-        if self.identity not in result.stdout.decode("utf-8"):
-            logging.info(f"Signing identity not found: {self.identity}")
+            result = subprocess_wrapper.run(args, capture_output=True)
+            if result.returncode != 0:
+                subprocess_wrapper.SubprocessErrorLogging(result).log()
+                return False
+
+            SignPackage._identity_cache = {
+                identity_hash.decode("utf-8"): name.decode("utf-8") for identity_hash, name in IDENTITY_PATTERN.findall(result.stdout)
+            }
+
+        # Match against the hash or name columns only, pkgbuild and productbuild accept either.
+        if self.identity not in SignPackage._identity_cache and not any(self.identity in name for name in SignPackage._identity_cache.values()):
+            logging.info("Signing identity not found: %s", self.identity)
             return False
 
+        self._identity_valid = True
+
         return True
 
 
@@ -54,23 +84,24 @@ class SignPackage:
         Sign package.
         """
 
-        if self._is_identity_valid() is False:
+        if self.is_identity_valid() is False:
             return False
 
+        signed = f"{self.pkg}.signed"
+
         args = [
             PRODUCTSIGN,
             "--sign", self.identity,
             self.pkg,
-            str(self.pkg) + ".signed",
+            signed,
         ]
 
-        result = subprocess.run(args, capture_output=True)
+        result = subprocess_wrapper.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0:
             subprocess_wrapper.SubprocessErrorLogging(result).log()
             return False
 
-        # Replace the original package with the signed one.
-        Path(self.pkg).unlink()
-        Path(str(self.pkg) + ".signed").rename(self.pkg)
+        # Atomically replace the original package with the signed one.
+        os.replace(signed, self.pkg)
 
         return True
\ No newline at end of file
@@ -8,12 +8,33 @@ import subprocess
 from pathlib import Path
 
 
+def run(command: list, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Run subprocess command, allowing CPython to launch it through posix_spawn().
+
+    CPython only takes the posix_spawn() path when 'close_fds' is disabled, the executable
+    has a directory component (ex. '/usr/bin/xattr' rather than 'xattr'), and no 'cwd',
+    'preexec_fn' or session changes are requested.
+    Python opens file descriptors as non-inheritable by default (PEP 446), so
+    disabling 'close_fds' does not leak descriptors to the child.
+    """
+    return subprocess.run(command, close_fds=False, **kwargs)
+
+
+def spawn(command: list, **kwargs) -> subprocess.Popen:
+    """
+    Start subprocess command without waiting on it, see run() for the posix_spawn() requirements.
+    """
+    return subprocess.Popen(command, close_fds=False, **kwargs)
+
+
 class SubprocessErrorLogging:
     """
     Display subprocess error output.
     """
     def __init__(self, process: subprocess.CompletedProcess) -> None:
         self.process = process
+        self._caller = None
 
 
     def __str__(self) -> str:
@@ -33,51 +54,61 @@ class SubprocessErrorLogging:
             <standard error line 2>
             ...
         """
-        output = "Error: Subprocess failed.\n"
-        output += f"    Command: {self.process.args}\n"
-        output += f"    Return Code: {self.process.returncode}\n"
-        output += f"    Standard Output:\n"
-        output += self._format_output(self.process.stdout.decode("utf-8"))
-        output += f"    Standard Error:\n"
-        output += self._format_output(self.process.stderr.decode("utf-8"))
-        output += f"\n    Called by: {self._get_caller()}\n"
-
-
-        return output
+        return "\n".join([
+            "Error: Subprocess failed.",
+            f"    Command: {self.process.args}",
+            f"    Return Code: {self.process.returncode}",
+            "    Standard Output:",
+            self._format_output(self._decode_output(self.process.stdout)),
+            "    Standard Error:",
+            self._format_output(self._decode_output(self.process.stderr)),
+            "",
+            f"    Called by: {self._caller or self._get_caller()}",
+        ])
 
     def _get_caller(self) -> str:
         """
         See which function called the subprocess.
         """
-        _level = 2
-        while True:
-            frame = sys._getframe(_level)
+        # Follow the frame chain directly, rather than re-walking the stack per level.
+        frame = sys._getframe(1)
+        for _ in range(10):
             if frame is None:
-                return "Unknown"
+                break
             if frame.f_code.co_filename != __file__:
                 return f"{Path(frame.f_code.co_filename).name} -> {frame.f_code.co_name}() -> Line {frame.f_lineno}"
-            _level += 1
-
-            if _level > 10:
-                break
+            frame = frame.f_back
         return "Unknown"
 
 
+    def _decode_output(self, output) -> str:
+        """
+        Decode output, which may be bytes, text or not captured at all (ex. DEVNULL).
+        """
+        if output is None:
+            return ""
+        if isinstance(output, bytes):
+            return output.decode("utf-8")
+        return output
+
+
     def _format_output(self, output: str) -> str:
         """
         Format output.
         """
         if not output:
-            return "        None\n"
+            return "        None"
 
-        return "\n".join([f"        {line}" for line in output.split("\n") if line not in ["", "\n"]])
+        return "\n".join(f"        {line}" for line in output.splitlines() if line)
 
 
     def log(self) -> None:
         """
         Log subprocess error output.
         """
-        logging.error(str(self))
+        # Resolve the caller now, formatting is deferred until a handler emits the record.
+        self._caller = self._get_caller()
+        logging.error("%s", self)
 
 
 class SubprocessWrapper:
@@ -93,7 +124,8 @@ class SubprocessWrapper:
         """
         Run subprocess command.
         """
-        process = subprocess.run(self.command, capture_output=True)
+        # Only standard error is logged on failure, avoid buffering standard output.
+        process = run(self.command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if process.returncode != 0:
             SubprocessErrorLogging(process).log()
             if self.raise_on_error:
@@ -0,0 +1,74 @@
+"""
+workspace.py: Working directory management shared by package builders.
+"""
+
+import tempfile
+
+from pathlib import Path
+
+
+class PackageWorkspace:
+    """
+    Mixin managing the working directory of a package build.
+
+    The directory is created lazily on build, either as a temporary directory or the one provided by the caller.
+    Subclasses implement _define_workspace() to derive their paths, and _clear_workspace() to remove previous staging.
+    """
+
+    def _init_workspace(self, work_directory: str = None) -> None:
+        """
+        Configure the working directory, created on build, see _ensure_workspace().
+        """
+        self._pkg_work_directory = work_directory
+        self._pkg_temp_handle    = None
+        self._pkg_temp_directory = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        self.cleanup()
+
+
+    def cleanup(self) -> None:
+        """
+        Remove the working directory, unless provided by the caller.
+        """
+        if self._pkg_temp_handle is not None:
+            self._pkg_temp_handle.cleanup()
+            self._pkg_temp_handle = None
+        self._pkg_temp_directory = None
+
+
+    def _ensure_workspace(self) -> None:
+        """
+        Create the working directory on first build, then clear any previous staging within it.
+        """
+        if self._pkg_temp_directory is None:
+            # Allow callers to provide a working directory, ex. when batching multiple builds.
+            if self._pkg_work_directory is None:
+                # Keep the handle, directory is removed once the instance is garbage collected.
+                self._pkg_temp_handle    = tempfile.TemporaryDirectory()
+                self._pkg_temp_directory = Path(self._pkg_temp_handle.name)
+            else:
+                self._pkg_temp_directory = Path(self._pkg_work_directory)
+            self._define_workspace()
+
+        # Clear previous staging, including from caller provided directories.
+        self._clear_workspace()
+
+
+    def _define_workspace(self) -> None:
+        """
+        Derive paths within the working directory.
+        """
+        raise NotImplementedError
+
+
+    def _clear_workspace(self) -> None:
+        """
+        Remove staging left by a previous build.
+        """
+        raise NotImplementedError
@@ -2,11 +2,93 @@
 xattr.py
 """
 
+import os
+import errno
+import ctypes
+import logging
 import subprocess
 
 from . import subprocess_wrapper
 
 
+XATTR: str = "/usr/bin/xattr"
+
+# Python only exposes os.listxattr() and os.removexattr() on Linux, call into libc directly on macOS.
+# Reference:
+# https://github.com/apple-oss-distributions/xnu/blob/xnu-10063.121.3/bsd/sys/xattr.h
+try:
+    _libc = ctypes.CDLL("/usr/lib/libc.dylib", use_errno=True)
+except OSError:
+    _libc = None
+
+_listxattr = getattr(_libc, "listxattr", None)
+if _listxattr is not None:
+    _listxattr.argtypes = [
+        ctypes.c_char_p,  # Path
+        ctypes.c_char_p,  # Name buffer
+        ctypes.c_size_t,  # Buffer size
+        ctypes.c_int,     # Options
+    ]
+    _listxattr.restype = ctypes.c_ssize_t
+
+_removexattr = getattr(_libc, "removexattr", None)
+if _removexattr is not None:
+    _removexattr.argtypes = [
+        ctypes.c_char_p,  # Path
+        ctypes.c_char_p,  # Name
+        ctypes.c_int,     # Options
+    ]
+    _removexattr.restype = ctypes.c_int
+
+# Fall back to xattr(1) only if neither libc nor Python provide the calls.
+NATIVE_XATTR: bool = _removexattr is not None or hasattr(os, "removexattr")
+
+# Attribute not present, or not supported by the volume.
+MISSING_XATTR_ERRORS: tuple = (getattr(errno, "ENOATTR", errno.ENODATA), errno.ENOTSUP, errno.EOPNOTSUPP)
+
+
+def _raise_errno(path: str) -> None:
+    """
+    Raise OSError from the last libc call.
+    """
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error), path)
+
+
+def list_xattr(path: str) -> list:
+    """
+    List extended attribute names of a file.
+    """
+    if _listxattr is None:
+        return os.listxattr(path)
+
+    encoded = os.fsencode(path)
+    size = _listxattr(encoded, None, 0, 0)
+    if size < 0:
+        _raise_errno(path)
+    if size == 0:
+        return []
+
+    buffer = ctypes.create_string_buffer(size)
+    size = _listxattr(encoded, buffer, size, 0)
+    if size < 0:
+        _raise_errno(path)
+
+    return [os.fsdecode(name) for name in buffer.raw[:size].split(b"\0") if name]
+
+
+def remove_xattr(path: str, key: str) -> None:
+    """
+    Remove an extended attribute from a file.
+    """
+    if _removexattr is None:
+        os.removexattr(path, key)
+        return
+
+    if _removexattr(os.fsencode(path), os.fsencode(key), 0) != 0:
+        _raise_errno(path)
+
+
 class ExtendedAttributes:
 
     def __init__(self, file: str):
@@ -17,13 +99,22 @@ class ExtendedAttributes:
         """
         Strip all extended attributes.
         """
+        if NATIVE_XATTR is True:
+            try:
+                for key in list_xattr(self._file):
+                    remove_xattr(self._file, key)
+            except OSError as error:
+                logging.error("Failed to strip extended attributes: %s", error)
+                return False
+            return True
+
         args = [
-            "/usr/bin/xattr",
+            XATTR,
             "-c",
             self._file,
         ]
 
-        result = subprocess.run(args, capture_output=True)
+        result = subprocess_wrapper.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0:
             subprocess_wrapper.SubprocessErrorLogging(result).log()
             return False
@@ -35,15 +126,24 @@ class ExtendedAttributes:
         """
         Strip extended attribute.
         """
+        if NATIVE_XATTR is True:
+            try:
+                remove_xattr(self._file, key)
+            except OSError as error:
+                # Missing attributes are expected, ex. files never downloaded aren't quarantined.
+                if error.errno not in MISSING_XATTR_ERRORS:
+                    logging.warning("Failed to strip extended attribute '%s': %s", key, error)
+            return True
 
         args = [
-            "/usr/bin/xattr",
+            XATTR,
             "-d",
             key,
             self._file,
         ]
 
-        subprocess.run(args, capture_output=True)
+        # Failures are expected for missing attributes, output is never read.
+        subprocess_wrapper.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         return True
 
 
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from setuptools import setup, find_packages
 
 def fetch_property(property: str) -> str:
@@ -10,11 +12,10 @@ def fetch_property(property: str) -> str:
     Returns:
         The value of the property.
     """
-    for line in open("macos_pkg_builder/__init__.py", "r").readlines():
-        if not line.startswith(property):
-            continue
-        return line.split("=")[1].strip().strip('"')
-    raise ValueError(f"Property {property} not found.")
+    line = next((line for line in Path("macos_pkg_builder/__init__.py").read_text().splitlines() if line.startswith(property)), None)
+    if line is None:
+        raise ValueError(f"Property {property} not found.")
+    return line.split("=")[1].strip().strip('"')
 
 
 def resolve_markdown_assets(file: str) -> str:
@@ -31,7 +32,7 @@ def resolve_markdown_assets(file: str) -> str:
     repo_base = fetch_property("__url__:")
     repo_raw = repo_base.replace("github.com", "raw.githubusercontent.com")
 
-    contents = open(file, "r").read()
+    contents = Path(file).read_text(encoding="utf-8")
     contents = contents.replace("src=\"Samples/Demos/Markdown-Welcome.png\"", f"src=\"{repo_raw}/main/Samples/Demos/Markdown-Welcome.png\"")
 
     return contents
@@ -47,7 +48,7 @@ setup(
     long_description=resolve_markdown_assets("README.md"),
     long_description_content_type='text/markdown',
     license='',
-    python_requires='>=3.6',
+    python_requires='>=3.9',
     packages=find_packages(include=["macos_pkg_builder", "macos_pkg_builder.utilities"]),
     package_data={
         "macos_pkg_builder": [
@@ -63,5 +64,5 @@ setup(
         ],
     },
     py_modules=["macos_pkg_builder"],
-    install_requires=open("requirements.txt", "r").readlines(),
+    install_requires=[line.strip() for line in Path("requirements.txt").read_text().splitlines() if line.strip() and not line.startswith("#")],
 )
\ No newline at end of file